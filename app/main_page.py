@@ -1,47 +1,179 @@
 import streamlit as st
 import onnx
-import os
-import matplotlib.pyplot as plt
+import io
+from matplotlib import colormaps
+from matplotlib.figure import Figure
 import numpy as np
-from pathlib import Path
 from xaivision.utils import (load_models, model_details, sample_details,
                              conv2d_feature_vis_extra_layers,
                              conv2d_feature_vis_no_extra_layers,
-                             find_components, MedPCacheDataset_normalised)
+                             find_components, MedPCacheDataset_normalised,
+                             PNG_SAVE_KWARGS)
 from xaivision.xai_tools import (vision_shap, integrated_grad, deeplift,
-                                 shap_overview)
-
-
-def delete_torch_model_files():
-    file_1 = os.path.join(str(Path(__file__).resolve().parent),
-                          "TorchModel_torchviz")
-    file_2 = os.path.join(str(Path(__file__).resolve().parent),
-                          "TorchModel_torchviz.png")
-    if os.path.exists(file_1):
-        os.remove(file_1)
-    if os.path.exists(file_2):
-        os.remove(file_2)
+                                 shap_overview, deep_explainer)
+
+# Every upload gets a new file_id, even when the same file is uploaded
+# again, so the caches keyed on it are bounded in size and age instead of
+# keeping the models, datasets and explainers in memory until a restart
+UPLOAD_CACHE_ENTRIES = 4
+UPLOAD_CACHE_TTL = "1h"
+
+
+@st.cache_resource(max_entries=UPLOAD_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL)
+def get_model(model_id, _model_file):
+    # The onnx file is parsed and converted to torch once per upload
+    return load_models(onnx.load(_model_file))
+
+
+@st.cache_resource(max_entries=UPLOAD_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL)
+def get_dataset(data_id, _data_file):
+    # Every frame is read and converted to float32 once per upload
+    return MedPCacheDataset_normalised(_data_file, preload=True)
+
+
+@st.cache_resource(max_entries=UPLOAD_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL)
+def get_explainer(model_id, data_id, batch_size, _model, _data):
+    # Streamlit reruns the whole script on every interaction, the explainer
+    # is only rebuilt when a different model or dataset is uploaded
+    return deep_explainer(_data, batch_size, _model)
+
+
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL)
+def get_model_details(model_id, data_size, _model):
+    # The architecture is rendered in memory once per model instead of
+    # writing and reading back a png on every rerun
+    dot, model_summary = model_details(_model, data_size)
+    return dot.pipe(format="png"), model_summary
+
+
+@st.cache_data(max_entries=512)
+def get_vision_shap(model_id, data_id, batch_size, sample_number, _model,
+                    _data, _model_input):
+    # Samples are usually revisited, so the rendered plots are kept per
+    # sample and only the first visit pays for SHAP and matplotlib
+    explainer = get_explainer(model_id, data_id, batch_size, _model, _data)
+    plots, _ = vision_shap(_data, batch_size, _model, _model_input,
+                           explainer)
+    return [figure_png(plot) for plot in plots]
+
+
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL)
+def get_shap_overview(model_id, data_id, batch_background, batch_test,
+                      _model, _data):
+    # The overview takes no input from the page, it is computed and rendered
+    # once per uploaded model and dataset
+    plots = shap_overview(_data, batch_background, batch_test, _model)
+    return [figure_png(plot) for plot in plots]
+
+
+def figure_png(fig):
+    """
+    Render a figure to PNG bytes.
+
+    Parameters:
+        - fig (matplotlib.figure.Figure): The figure to render.
+
+    Returns:
+        bytes: The figure encoded as PNG.
+    """
+    buf = io.BytesIO()
+    # Same resolution as st.pyplot, which saves at 200 dpi
+    fig.savefig(buf, dpi=200, bbox_inches="tight", **PNG_SAVE_KWARGS)
+    return buf.getvalue()
+
+
+def sample_number_input(num_samples):
+    # The bounds keep out of range indices, including negative ones that
+    # would wrap around, from reaching the dataset
+    return int(
+        st.number_input("Sample Number:",
+                        min_value=0,
+                        max_value=num_samples - 1,
+                        step=1))
+
+
+def plot_grid(arrays, titles, colorbar=None):
+    """
+    Plot arrays side by side on a single figure with up to two columns.
+
+    Parameters:
+        - arrays (list): The 2D arrays to plot.
+        - titles (list): A title for each array.
+        - colorbar (str, optional): "each" to add a colorbar next to every
+                                    array, "shared" to add a single one for
+                                    the whole figure. Defaults to None.
+
+    Returns:
+        matplotlib.figure.Figure: The figure with all the arrays.
+    """
+    num_cols = 1 if len(arrays) == 1 else 2
+    num_rows = (len(arrays) + 1) // 2
+    # Figures are created without pyplot, so nothing is left behind in its
+    # global figure manager between reruns
+    fig = Figure(figsize=(5 * num_cols, 5 * num_rows))
+    axes = fig.subplots(num_rows, num_cols, squeeze=False)
+
+    for ax, array, title in zip(axes.flat, arrays, titles):
+        im = ax.imshow(array, cmap="viridis")
+        ax.set_title(title)
+        if colorbar == "each":
+            fig.colorbar(im, ax=ax)
+
+    for ax in axes.flat[len(arrays):]:
+        ax.axis("off")
+
+    fig.tight_layout(pad=3.0)
+    if colorbar == "shared":
+        fig.subplots_adjust(right=0.8)
+        cbar_ax = fig.add_axes([0.85, 0.15, 0.05, 0.7])
+        fig.colorbar(im, cax=cbar_ax)
+
+    return fig
+
+
+def heatmap_images(arrays):
+    """
+    Colour arrays with the viridis colormap without drawing a figure.
+
+    Parameters:
+        - arrays (list): The 2D arrays to colour.
+
+    Returns:
+        list: RGBA images (numpy.ndarray of uint8), one per array, each
+                scaled to its own min and max.
+    """
+    images = []
+    for array in arrays:
+        array = np.asarray(array, dtype=np.float32)
+        span = array.max() - array.min()
+        if span > 0:
+            array = (array - array.min()) / span
+        else:
+            array = np.zeros_like(array)
+        images.append(colormaps["viridis"](array, bytes=True))
+    return images
 
 
 st.set_page_config(page_title="Demo", layout="wide", page_icon="📈")
 
 background = 40
 samples = 10
+RAW_HEATMAPS_LABEL = "Raw heatmaps (faster, no axes or colorbar)"
 
 st.title("XAI Dashboard")
 
 uploaded_model = st.file_uploader("Upload model", type=["onnx"])
 model_flag = False
 if uploaded_model is not None:
-    model = onnx.load(uploaded_model)
-    model_py = load_models(model)
+    model_py = get_model(uploaded_model.file_id, uploaded_model)
     model_flag = True
 
 uploaded_data = st.file_uploader("Upload data", type=["h5"])
 data_flag = False
 
 if uploaded_data is not None:
-    ds = MedPCacheDataset_normalised(uploaded_data)
+    ds = get_dataset(uploaded_data.file_id, uploaded_data)
+    num_samples = len(ds)
 
 if uploaded_model is not None and uploaded_data is not None:
 
@@ -65,19 +197,16 @@ if uploaded_model is not None and uploaded_data is not None:
         st.header("Model Details")
         model_input, ground_truth = ds.__getitem__(0)
         sample_size = model_input.shape
-        dot, model_summary = model_details(model_py, sample_size)
-        dot = dot.render("TorchModel_torchviz", format="png")
-        image_path = os.path.join(str(Path(__file__).resolve().parent),
-                                  "TorchModel_torchviz.png")
-        st.image(dot)
+        architecture, model_summary = get_model_details(
+            uploaded_model.file_id, sample_size, model_py)
+        st.image(architecture)
         # Display model summary
         st.subheader("Model Architecture:")
         st.text(model_summary)
     elif functionality == "Data Sample Details":
-        delete_torch_model_files()
         st.header("Data Sample Details")
         # Ask for a number input
-        sample_number = int(st.number_input("Sample Number:", step=1))
+        sample_number = sample_number_input(num_samples)
         if sample_number is not None:
             model_input, ground_truth = ds.__getitem__(sample_number)
             model_output = sample_details(model_py, model_input)
@@ -85,65 +214,47 @@ if uploaded_model is not None and uploaded_data is not None:
             while 1 in arr.shape:
                 arr = np.squeeze(arr)
 
-            plt.imshow(arr)
+            fig = Figure()
+            ax = fig.add_subplot()
+            ax.imshow(arr)
             title = "Model_output: " + str(model_output) + "\n"
             title = title + "Ground Truth: " + str(ground_truth)
-            plt.title(title)
-            st.pyplot(plt)
+            ax.set_title(title)
+            st.image(figure_png(fig), use_column_width=True)
 
     elif functionality == "Convolutional Features Isolated":
-        delete_torch_model_files()
         st.header("Convolutional Features Isolated")
-        sample_number = int(st.number_input("Sample Number:", step=1))
+        sample_number = sample_number_input(num_samples)
         if sample_number is not None:
             model_input, ground_truth = ds.__getitem__(sample_number)
 
             arrays, names = conv2d_feature_vis_no_extra_layers(
                 model_py, model_input)
-
-            num_arrays = len(arrays)
-            # Calculate the number of rows needed
-            num_rows = (num_arrays + 1) // 2
-            fig, axes = plt.subplots(num_rows, 2, figsize=(10, 5 * num_rows))
-            fig.tight_layout(pad=3.0)
-            for i, array in enumerate(arrays):
-                row = i // 2
-                col = i % 2
-                ax = axes[row, col] if num_rows > 1 else axes[col]
-                im = ax.imshow(array, cmap="viridis")
-                plt.colorbar(im, ax=ax)
-                ax.set_title(names[i].split("(")[0] + str(i))
-            st.pyplot(plt)
+            titles = [
+                name.split("(")[0] + str(i) for i, name in enumerate(names)
+            ]
+            fig = plot_grid(arrays, titles, colorbar="each")
+            st.image(figure_png(fig), use_column_width=True)
 
     elif functionality == "Convolutional Features Non - Isolated":
-        delete_torch_model_files()
         st.header("Convolutional Features Non - Isolated")
-        sample_number = int(st.number_input("Sample Number:", step=1))
+        sample_number = sample_number_input(num_samples)
         if sample_number is not None:
             model_input, ground_truth = ds.__getitem__(sample_number)
 
             arrays, names = conv2d_feature_vis_extra_layers(
                 model_py, model_input)
-            num_arrays = len(arrays)
-
-            # Calculate the number of rows needed
-            num_rows = (num_arrays + 1) // 2
-            fig, axes = plt.subplots(num_rows, 2, figsize=(10, 5 * num_rows))
-            fig.tight_layout(pad=3.0)
-            for i, array in enumerate(arrays):
-                row = i // 2
-                col = i % 2
-                ax = axes[row, col] if num_rows > 1 else axes[col]
-                im = ax.imshow(array, cmap="viridis")
-                plt.colorbar(im, ax=ax)
-                ax.set_title(names[i].split("(")[0] + str(i))
-            st.pyplot(plt)
+            titles = [
+                name.split("(")[0] + str(i) for i, name in enumerate(names)
+            ]
+            fig = plot_grid(arrays, titles, colorbar="each")
+            st.image(figure_png(fig), use_column_width=True)
 
     elif functionality == "Sample Components":
-        delete_torch_model_files()
         st.header("Sample Components")
-        sample_number = int(st.number_input("Sample Number:", step=1))
+        sample_number = sample_number_input(num_samples)
         num_components = int(st.number_input("Number of Components:", step=1))
+        raw_heatmaps = st.checkbox(RAW_HEATMAPS_LABEL)
         if sample_number is not None and num_components is not None:
             if num_components < 2:
                 st.write("No valid number for components")
@@ -151,124 +262,68 @@ if uploaded_model is not None and uploaded_data is not None:
                 model_input, ground_truth = ds.__getitem__(sample_number)
                 heatmaps = find_components(model_py, model_input,
                                            num_components)
-
-                num_rows = (num_components +
-                            1) // 2  # Calculate the number of rows needed
-                fig, axes = plt.subplots(num_rows,
-                                         2,
-                                         figsize=(10, 5 * num_rows))
-                fig.tight_layout(pad=3.0)
-
-                for i in range(num_components):
-                    row = i // 2
-                    col = i % 2
-                    ax = axes[row, col] if num_rows > 1 else axes[col]
-                    ax.imshow(heatmaps[0][i])
-                    ax.set_title("component_" + str(i))
-
-                for i in range(num_components, num_rows * 2):
-                    axes[num_rows - 1][i % 2].axis("off")
-
-                plt.tight_layout()
-
-                st.pyplot(plt)
+                titles = [
+                    "component_" + str(i) for i in range(num_components)
+                ]
+                if raw_heatmaps:
+                    st.image(heatmap_images(heatmaps[0]),
+                             caption=titles,
+                             width=300)
+                else:
+                    fig = plot_grid(heatmaps[0], titles)
+                    st.image(figure_png(fig), use_column_width=True)
 
     elif functionality == "Integrated Gradients":
-        delete_torch_model_files()
         st.header("Integrated Gradients")
-        sample_number = int(st.number_input("Sample Number:", step=1))
+        sample_number = sample_number_input(num_samples)
+        raw_heatmaps = st.checkbox(RAW_HEATMAPS_LABEL)
         if sample_number is not None:
             model_input, ground_truth = ds.__getitem__(sample_number)
             grads = integrated_grad(model_py, model_input)
-            if len(grads) == 1:
-                fig, ax = plt.subplots(1, 1, figsize=(5, 5))
-
-                im = ax.imshow(grads)
-                ax.axis("off")
-                ax.set_title("integrated grad")
+            titles = [
+                "integrated grad value " + str(i) for i in range(len(grads))
+            ]
+            if raw_heatmaps:
+                st.image(heatmap_images(grads), caption=titles, width=300)
             else:
-
-                # Calculate the number of rows needed
-                num_rows = (len(grads) + 1) // 2
-                fig, axes = plt.subplots(num_rows,
-                                         2,
-                                         figsize=(10, 5 * num_rows))
-                fig.tight_layout(pad=3.0)
-
-                for i, array in enumerate(grads):
-                    row = i // 2
-                    col = i % 2
-                    ax = axes[row, col] if num_rows > 1 else axes[col]
-
-                    im = ax.imshow(array)
-
-                    ax.set_title("integrated grad value " + str(i))
-
-                for i in range(len(grads), num_rows * 2):
-                    axes[num_rows - 1][i % 2].axis("off")
-
-                plt.tight_layout()
-            fig.subplots_adjust(right=0.8)
-            cbar_ax = fig.add_axes([0.85, 0.15, 0.05, 0.7])
-            fig.colorbar(im, cax=cbar_ax)
-            st.pyplot(plt)
+                fig = plot_grid(grads, titles, colorbar="shared")
+                st.image(figure_png(fig), use_column_width=True)
 
     elif functionality == "Deep Lift":
-        delete_torch_model_files()
         st.header("Deep Lift")
-        sample_number = int(st.number_input("Sample Number:", step=1))
+        sample_number = sample_number_input(num_samples)
+        raw_heatmaps = st.checkbox(RAW_HEATMAPS_LABEL)
         if sample_number is not None:
             model_input, ground_truth = ds.__getitem__(sample_number)
             dl_arrays = deeplift(model_py, model_input)
-            if len(dl_arrays) == 1:
-                fig, ax = plt.subplots(1, 1, figsize=(5, 5))
-
-                im = ax.imshow(dl_arrays[0])
-                ax.axis("off")
-                ax.set_title("integrated grad")
+            titles = [
+                "deep lift value " + str(i) for i in range(len(dl_arrays))
+            ]
+            if raw_heatmaps:
+                st.image(heatmap_images(dl_arrays), caption=titles, width=300)
             else:
-
-                num_rows = (len(dl_arrays) +
-                            1) // 2  # Calculate the number of rows needed
-                fig, axes = plt.subplots(num_rows,
-                                         2,
-                                         figsize=(10, 5 * num_rows))
-                fig.tight_layout(pad=3.0)
-
-                for i, array in enumerate(dl_arrays):
-                    row = i // 2
-                    col = i % 2
-                    ax = axes[row, col] if num_rows > 1 else axes[col]
-
-                    im = ax.imshow(array)
-
-                    ax.set_title("integrated grad value " + str(i))
-
-                for i in range(len(dl_arrays), num_rows * 2):
-                    axes[num_rows - 1][i % 2].axis("off")
-
-                plt.tight_layout()
-            fig.subplots_adjust(right=0.8)
-            cbar_ax = fig.add_axes([0.85, 0.15, 0.05, 0.7])
-            fig.colorbar(im, cax=cbar_ax)
-            st.pyplot(plt)
+                fig = plot_grid(dl_arrays, titles, colorbar="shared")
+                st.image(figure_png(fig), use_column_width=True)
 
     elif functionality == "SHAP single sample":
-        delete_torch_model_files()
         st.header("SHAP single sample")
-        sample_number = int(st.number_input("Sample Number:", step=1))
+        sample_number = sample_number_input(num_samples)
         if sample_number is not None:
             model_input, ground_truth = ds.__getitem__(sample_number)
-            plots = vision_shap(uploaded_data, samples, model_py, model_input)
+            plots = get_vision_shap(uploaded_model.file_id,
+                                    uploaded_data.file_id, samples,
+                                    sample_number, model_py, uploaded_data,
+                                    model_input)
             for i, plot in enumerate(plots):
                 st.subheader("SHAP output for target " + str(i))
-                st.pyplot(plot)
+                st.image(plot, use_column_width=True)
 
     elif functionality == "SHAP overview":
-        delete_torch_model_files()
         st.header("SHAP overview")
-        plots = shap_overview(uploaded_data, background, samples, model_py)
+        plots = get_shap_overview(uploaded_model.file_id,
+                                  uploaded_data.file_id, background, samples,
+                                  model_py, uploaded_data)
         for i, plot in enumerate(plots):
             st.subheader("SHAP pixels overview contribution for target " +
                          str(i))
-            st.pyplot(plot)
+            st.image(plot, use_column_width=True)
@@ -1,7 +1,7 @@
 from argparse import ArgumentParser
 import os
 import shutil
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import torch
 import numpy as np
 from pathlib import Path
@@ -16,6 +16,7 @@ from xaivision.utils import (
     conv2d_feature_vis_extra_layers,
     conv2d_feature_vis_no_extra_layers,
     find_components,
+    PNG_SAVE_KWARGS,
 )
 
 from xaivision.xai_tools import (vision_shap,
@@ -129,12 +130,13 @@ if __name__ == "__main__":
     while 1 in arr.shape:
         arr = np.squeeze(arr)
 
-    plt.imshow(arr)
+    fig = Figure()
+    ax = fig.add_subplot()
+    ax.imshow(arr)
     title = "Model_output: " + str(model_output) + "\n"
     title = title + "Ground Truth: " + str(ground_truth)
-    plt.title(title)
-    plt.savefig(folder_path_sample + "/sample.png")
-    plt.close()
+    ax.set_title(title)
+    fig.savefig(folder_path_sample + "/sample.png", **PNG_SAVE_KWARGS)
 
     print("----FUNCTIONALITY 4----")
 
@@ -154,17 +156,18 @@ if __name__ == "__main__":
 
     num_arrays = len(arrays)
     num_rows = (num_arrays + 1) // 2  # Calculate the number of rows needed
-    fig, axes = plt.subplots(num_rows, 2, figsize=(10, 5 * num_rows))
+    fig = Figure(figsize=(10, 5 * num_rows))
+    axes = fig.subplots(num_rows, 2)
     fig.tight_layout(pad=3.0)
     for i, array in enumerate(arrays):
         row = i // 2
         col = i % 2
         ax = axes[row, col] if num_rows > 1 else axes[col]
         im = ax.imshow(array, cmap="viridis")
-        plt.colorbar(im, ax=ax)
+        fig.colorbar(im, ax=ax)
         ax.set_title(names[i].split("(")[0] + str(i))
-    plt.savefig(folder_path_sample +
-                "/activation_map_with_no_extra_layers.png")
+    fig.savefig(folder_path_sample +
+                "/activation_map_with_no_extra_layers.png", **PNG_SAVE_KWARGS)
 
     print("----FUNCTIONALITY 6----")
 
@@ -174,17 +177,18 @@ if __name__ == "__main__":
 
     num_arrays = len(arrays)
     num_rows = (num_arrays + 1) // 2  # Calculate the number of rows needed
-    fig, axes = plt.subplots(num_rows, 2, figsize=(10, 5 * num_rows))
+    fig = Figure(figsize=(10, 5 * num_rows))
+    axes = fig.subplots(num_rows, 2)
     fig.tight_layout(pad=3.0)
     for i, array in enumerate(arrays):
         row = i // 2
         col = i % 2
         ax = axes[row, col] if num_rows > 1 else axes[col]
         im = ax.imshow(array, cmap="viridis")
-        plt.colorbar(im, ax=ax)
+        fig.colorbar(im, ax=ax)
         ax.set_title(names[i].split("(")[0] + str(i))
-    plt.savefig(folder_path_sample + "/activation_map_with_extra_layers.png")
-    plt.close()
+    fig.savefig(folder_path_sample + "/activation_map_with_extra_layers.png",
+                **PNG_SAVE_KWARGS)
 
     print("----FUNCTIONALITY 7----")
 
@@ -202,12 +206,14 @@ if __name__ == "__main__":
 
     heatmaps = find_components(torch_model, model_input, components)
 
+    # One figure is reused for every image that is saved
+    fig = Figure()
+    ax = fig.add_subplot()
     for i in range(components):
-        plt.clf()
-        plt.imshow(heatmaps[0][i])
-        plt.savefig(folder_path_components + "/component_" + str(i + 1) +
-                    ".png")
-    plt.close()
+        ax.clear()
+        ax.imshow(heatmaps[0][i])
+        fig.savefig(folder_path_components + "/component_" + str(i + 1) +
+                    ".png", **PNG_SAVE_KWARGS)
 
     print("----FUNCTIONALITY 8----")
 
@@ -220,8 +226,8 @@ if __name__ == "__main__":
     overview_plt = shap_overview(data_path, background, samples, torch_model)
 
     for i, plot in enumerate(overview_plt):
-        plot.savefig(folder_path + "/shap_overview_value_" + str(i) + ".png")
-        plt.close()
+        plot.savefig(folder_path + "/shap_overview_value_" + str(i) + ".png",
+                     **PNG_SAVE_KWARGS)
 
     print("----FUNCTIONALITY 9----")
 
@@ -232,8 +238,8 @@ if __name__ == "__main__":
                                          model_input)
 
     for i, plot in enumerate(shap_plots):
-        plot.savefig(folder_path_sample + "/shap_value_" + str(i) + ".png")
-        plt.close()
+        plot.savefig(folder_path_sample + "/shap_value_" + str(i) + ".png",
+                     **PNG_SAVE_KWARGS)
 
     arr = shap_table[0].copy()
     while 1 in arr.shape:
@@ -260,11 +266,13 @@ if __name__ == "__main__":
     # Save integrated gradient results
     grads = integrated_grad(torch_model, model_input)
 
+    fig = Figure()
+    ax = fig.add_subplot()
     for i, array in enumerate(grads):
-        plt.imshow(array)
-        plt.savefig(folder_path_sample + "/integrated_grad_value_" +
-                    str(i + 1) + ".png")
-        plt.close()
+        ax.clear()
+        ax.imshow(array)
+        fig.savefig(folder_path_sample + "/integrated_grad_value_" +
+                    str(i + 1) + ".png", **PNG_SAVE_KWARGS)
 
     print("----FUNCTIONALITY 12----")
 
@@ -272,8 +280,10 @@ if __name__ == "__main__":
     # Save deeplift results
     dl_plots = deeplift(torch_model, model_input)
 
+    fig = Figure()
+    ax = fig.add_subplot()
     for i, array in enumerate(dl_plots):
-        plt.imshow(array)
-        plt.savefig(folder_path_sample + "/deep_lift_value_" + str(i + 1) +
-                    ".png")
-        plt.close()
+        ax.clear()
+        ax.imshow(array)
+        fig.savefig(folder_path_sample + "/deep_lift_value_" + str(i + 1) +
+                    ".png", **PNG_SAVE_KWARGS)
@@ -0,0 +1,42 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+try:
+    from xaivision.xai_tools import (connected_components,
+                                     zero_non_largest_components)
+except (Exception, ):
+    raise
+
+
+def test_connected_components():
+    # Two components, the diagonal one is larger and 8-connected
+    image = np.array([[1, 0, 0, 0, 1],
+                      [0, 1, 0, 0, 1],
+                      [0, 0, 1, 0, 0],
+                      [0, 0, 0, 1, 0],
+                      [0, 0, 0, 0, 0]], dtype=np.float32)
+
+    largest_component = connected_components(image)
+
+    assert largest_component == {(0, 0), (1, 1), (2, 2), (3, 3)}
+
+
+def test_connected_components_tie():
+    # Components of equal size, the first one found is returned
+    image = np.array([[1, 0, 1],
+                      [1, 0, 1]], dtype=np.float32)
+
+    assert connected_components(image) == {(0, 0), (1, 0)}
+
+
+def test_zero_non_largest_components():
+    image = np.array([[1, 1, 0, 0],
+                      [0, 0, 0, 1]], dtype=np.float32)
+
+    largest_component = connected_components(image)
+    filtered = zero_non_largest_components(image, largest_component)
+
+    assert np.array_equal(filtered, np.array([[1, 1, 0, 0], [0, 0, 0, 0]]))
@@ -0,0 +1,60 @@
+import pickle
+import sys
+from pathlib import Path
+
+import h5py
+import numpy as np
+import pytest
+import torch
+from torch.utils.data import DataLoader
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+try:
+    from xaivision.xai_tools import ImageDataset_normalised
+except (Exception, ):
+    raise
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    data_path = tmp_path / "test_data.h5"
+    with h5py.File(data_path, "w") as h5f:
+        h5f.create_dataset("x", data=np.random.rand(6, 16, 16))
+        h5f.create_dataset("y", data=np.random.rand(6, 2))
+    return data_path
+
+
+def test_len_and_getitem(dataset):
+    dataset_obj = ImageDataset_normalised(dataset)
+    assert len(dataset_obj) == 6
+    image, target = dataset_obj[0]
+    assert image.shape == (1, 16, 16)
+    assert image.dtype == np.float32
+    assert isinstance(target, torch.Tensor)
+    assert target.shape == (2, )
+
+
+def test_pickle_after_access(dataset):
+    dataset_obj = ImageDataset_normalised(dataset)
+    assert len(dataset_obj) == 6
+    image, _ = dataset_obj[2]
+
+    copied_obj = pickle.loads(pickle.dumps(dataset_obj))
+    image_copy, _ = copied_obj[2]
+    assert np.array_equal(image, image_copy)
+
+
+def test_spawn_workers_after_access(dataset):
+    dataset_obj = ImageDataset_normalised(dataset)
+    assert len(dataset_obj) == 6
+    expected, _ = dataset_obj[0]
+
+    loader = DataLoader(dataset_obj,
+                        batch_size=6,
+                        num_workers=2,
+                        multiprocessing_context="spawn")
+    images, targets = next(iter(loader))
+    assert images.shape == (6, 1, 16, 16)
+    assert targets.shape == (6, 2)
+    assert np.array_equal(images[0].numpy(), expected)
+    dataset_obj.close()
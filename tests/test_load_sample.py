@@ -1,3 +1,5 @@
+import pickle
+
 import pytest
 import numpy as np
 
@@ -8,11 +10,28 @@ from pathlib import Path
 
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 try:
-    from xaivision.utils import MedPCacheDataset_normalised, load_sample
+    from xaivision.utils import (LazyH5File, MedPCacheDataset_normalised,
+                                 load_sample)
 except (Exception, ):
     raise
 
 
+def test_lazy_h5_file_reopens_in_new_process(tmp_path):
+    data_path = tmp_path / "test_data.h5"
+    with h5py.File(data_path, "w") as h5f:
+        h5f.create_dataset("x", data=np.random.rand(2, 4, 4))
+
+    h5_file = LazyH5File(data_path)
+    first = h5_file.get()
+    assert h5_file.get() is first
+
+    # A handle opened under another pid is never reused
+    h5_file._h5f_pid = -1
+    assert h5_file.get() is not first
+    h5_file.close()
+    first.close()
+
+
 # Define test cases for MedPCacheDataset_normalised
 class TestMedPCacheDatasetNormalised:
 
@@ -35,6 +54,48 @@ class TestMedPCacheDatasetNormalised:
         assert isinstance(y, np.ndarray)
         assert y.shape == (2, )  # Assuming nominal_laser_params is length 2
 
+    def test_getitem_preload(self, dataset):
+        dataset_obj = MedPCacheDataset_normalised(dataset)
+        preloaded_obj = MedPCacheDataset_normalised(dataset, preload=True)
+        assert len(preloaded_obj) == 10
+        for index in [0, 9]:
+            x, y = dataset_obj[index]
+            x_pre, y_pre = preloaded_obj[index]
+            assert x_pre.shape == (1, 128, 128)
+            assert x_pre.dtype == np.float32
+            assert np.array_equal(x, x_pre)
+            assert np.array_equal(y, y_pre)
+
+    def test_getitem_preload_copy(self, dataset):
+        preloaded_obj = MedPCacheDataset_normalised(dataset, preload=True)
+        x, _ = preloaded_obj[0]
+        expected = x.copy()
+
+        # Changing an item in place must not reach the preloaded frames
+        x[...] = 0
+        x_again, _ = preloaded_obj[0]
+        assert np.array_equal(x_again, expected)
+
+    def test_pickle_after_access(self, dataset):
+        dataset_obj = MedPCacheDataset_normalised(dataset)
+        assert len(dataset_obj) == 10
+        x, _ = dataset_obj[3]
+
+        # The open h5 file is dropped and reopened by the copy
+        copied_obj = pickle.loads(pickle.dumps(dataset_obj))
+        x_copy, _ = copied_obj[3]
+        assert np.array_equal(x, x_copy)
+
+    def test_close(self, dataset):
+        dataset_obj = MedPCacheDataset_normalised(dataset)
+        x, _ = dataset_obj[0]
+        dataset_obj.close()
+        dataset_obj.close()
+
+        # Items can still be read after closing, the file is reopened
+        x_reopened, _ = dataset_obj[0]
+        assert np.array_equal(x, x_reopened)
+
 
 # Define test cases for load_sample
 class TestLoadSample:
@@ -0,0 +1,58 @@
+import sys
+from pathlib import Path
+
+import h5py
+import numpy as np
+import pytest
+import torch
+from torch import nn
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+try:
+    from xaivision.xai_tools import overall_score, pixels_effect
+except (Exception, ):
+    raise
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    data_path = tmp_path / "test_data.h5"
+    rng = np.random.default_rng(0)
+    with h5py.File(data_path, "w") as h5f:
+        h5f.create_dataset("x", data=rng.random((6, 16, 16)))
+        h5f.create_dataset("y", data=rng.random((6, 2)))
+    return data_path
+
+
+@pytest.fixture
+def model():
+    torch.manual_seed(0)
+    model_py = nn.Sequential(nn.Conv2d(1, 2, kernel_size=3), nn.ReLU(),
+                             nn.Flatten(), nn.Linear(2 * 14 * 14, 2))
+    return model_py.eval()
+
+
+def test_pixels_effect():
+    image_input = np.zeros((1, 8, 8), dtype=np.float32)
+    image_input[0, 3:5, 3:5] = 1
+    # Extreme attributions in the corners, outside the bright central area
+    shap_numpy = np.zeros((2, 1, 8, 8, 1), dtype=np.float32)
+    shap_numpy[0, 0, 0, 0, 0] = 5
+    shap_numpy[0, 0, 7, 7, 0] = -5
+    shap_numpy[1, 0, 0, 0, 0] = 2
+    shap_numpy[1, 0, 7, 7, 0] = -2
+
+    pixels_sample, effect_sample = pixels_effect(image_input, shap_numpy)
+
+    assert pixels_sample == [2, 2]
+    assert effect_sample == [5, 2]
+
+
+def test_overall_score(dataset, model):
+    torch.manual_seed(0)
+    pixels_off, effect = overall_score(dataset, 4, model)
+
+    # One mean per model output
+    assert pixels_off.shape == (2, )
+    assert effect.shape == (2, )
+    assert np.all(pixels_off >= 0)
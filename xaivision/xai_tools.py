@@ -15,19 +15,24 @@ from captum.attr import IntegratedGradients, DeepLift
 
 from itertools import chain
 
+
 from tqdm import tqdm
 
+from numba import njit
+
 import random
 
+import os
+
 import sys
 
 from pathlib import Path
 
 # from memory_profiler import profile
 
-sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
+sys.path.append(str(Path(__file__).resolve().parent))
 try:
-    from utils import full_squeeze
+    from utils import full_squeeze, LazyH5File
 except (Exception, ):
     raise
 
@@ -38,40 +43,44 @@ class ImageDataset_normalised(torch.utils.data.Dataset):
         self.path = path
         self.nominal_laser_params = np.array(nominal_laser_params).astype(
             np.float32)
+        self._h5_file = LazyH5File(self.path)
+
+        with h5py.File(self.path, "r") as h5f:
+            self._len = len(h5f['x'])
+
+    def close(self):
+        """Close the h5 file if it is open"""
+        self._h5_file.close()
 
     def __getitem__(self, idx):
         """Get image and target y values"""
-        with h5py.File(self.path) as h5f:
-            x = (np.expand_dims(np.array(h5f["x"][idx]).astype(np.float32),
-                                axis=0))
-            y = (np.array(h5f["y"][idx], dtype=np.float32) /
-                 self.nominal_laser_params)
-
-        image = np.array(x)
+        h5f = self._h5_file.get()
+        image = np.expand_dims(h5f["x"][idx].astype(np.float32), axis=0)
+        y = (np.array(h5f["y"][idx], dtype=np.float32) /
+             self.nominal_laser_params)
 
         # Get target
         target = torch.tensor(y)
         return image, target
 
     def __len__(self):
-        with h5py.File(self.path) as h5f:
-            return len(h5f['x'])
+        return self._len
 
 
 # @profile
-def vision_shap(data, batch_size, model_py, model_input):
-    """Compute SHAP (SHapley Additive exPlanations) values for a given image.
+def deep_explainer(data, batch_size, model_py):
+    """Build a SHAP DeepExplainer on a random background batch of a dataset.
+
+    The explainer only depends on the model and the background samples, so
+    it can be built once and reused for every sample that is explained.
 
     Args:
         - data: The dataset to be used.
-        - batch_size (int): Batch size for DataLoader.
+        - batch_size (int): Number of background samples.
         - model_py: The PyTorch model.
-        - sample_index (int): Index of the sample image for which SHAP values
-                            are computed.
 
     Returns:
-        list: A list of matplotlib figures containing SHAP value plots.
-
+        shap.DeepExplainer: The explainer for the given model.
     """
 
     ds = ImageDataset_normalised(data)
@@ -83,7 +92,33 @@ def vision_shap(data, batch_size, model_py, model_input):
 
     model = model_py.to(device)
 
-    explainer = shap.DeepExplainer(model, background)
+    return shap.DeepExplainer(model, background)
+
+
+# @profile
+def vision_shap(data, batch_size, model_py, model_input, explainer=None):
+    """Compute SHAP (SHapley Additive exPlanations) values for a given image.
+
+    Args:
+        - data: The dataset to be used.
+        - batch_size (int): Batch size for DataLoader.
+        - model_py: The PyTorch model.
+        - model_input: The sample image for which SHAP values are computed.
+        - explainer (shap.DeepExplainer, optional): A prebuilt explainer, see
+                            `deep_explainer`. Built from `data` when omitted.
+
+    Returns:
+        tuple: A tuple containing two elements:
+            - plots (list): A list of matplotlib figures containing SHAP
+                            value plots.
+            - shap_numpy (numpy.ndarray): The SHAP values for each target.
+
+    """
+
+    device = torch.device('cpu')
+
+    if explainer is None:
+        explainer = deep_explainer(data, batch_size, model_py)
 
     test_image = np.expand_dims(model_input, axis=0)
     test_image = torch.tensor(test_image).to(device)
@@ -101,11 +136,64 @@ def vision_shap(data, batch_size, model_py, model_input):
     plots = []
     for value in shap_numpy:
         shap.image_plot(value, test_numpy, show=False)
-        plots.append(plt.gcf())
-        plt.close()
+        fig = plt.gcf()
+        plots.append(fig)
+        plt.close(fig)
     return plots, shap_numpy
 
 
+@njit(cache=True)
+def label_components(binary):
+    """
+    Labels the 8-connected components of a binary image.
+
+    Components are labelled from 1 in the order their first pixel is met
+    when scanning the image row by row.
+
+    Args:
+        - binary (numpy.ndarray): A 2D boolean array.
+
+    Returns:
+        tuple: A tuple containing two arrays:
+            - The label of every pixel, 0 for background pixels.
+            - The size of every label, index 0 is unused.
+    """
+
+    height, width = binary.shape
+    labels = np.zeros((height, width), dtype=np.int64)
+    sizes = np.zeros(height * width + 1, dtype=np.int64)
+    # Pixels are labelled when pushed, so each one enters the stack once
+    stack = np.empty((height * width, 2), dtype=np.int64)
+    label_count = 0
+
+    for i in range(height):
+        for j in range(width):
+            if not binary[i, j] or labels[i, j] != 0:
+                continue
+            label_count += 1
+            labels[i, j] = label_count
+            stack[0, 0] = i
+            stack[0, 1] = j
+            top = 1
+            while top > 0:
+                top -= 1
+                cx = stack[top, 0]
+                cy = stack[top, 1]
+                sizes[label_count] += 1
+                for dx in range(-1, 2):
+                    for dy in range(-1, 2):
+                        nx = cx + dx
+                        ny = cy + dy
+                        if (0 <= nx < height and 0 <= ny < width
+                                and binary[nx, ny] and labels[nx, ny] == 0):
+                            labels[nx, ny] = label_count
+                            stack[top, 0] = nx
+                            stack[top, 1] = ny
+                            top += 1
+
+    return labels, sizes[:label_count + 1]
+
+
 # @profile
 def connected_components(image):
     """
@@ -121,82 +209,15 @@ def connected_components(image):
             component.
     """
 
-    height = len(image)
-    width = len(image[0])
+    labels, sizes = label_components(np.asarray(image) == 1)
 
-    # Function to get neighbors of a pixel
-    def get_neighbors(x, y):
-        """
-        Gets the neighboring pixel coordinates of a given pixel.
-
-        Args:
-            - x (int): X-coordinate of the pixel.
-            - y (int): Y-coordinate of the pixel.
-
-        Returns:
-            - list: List of neighboring pixel coordinates.
-        """
-        neighbors = []
-        for dx in [-1, 0, 1]:
-            for dy in [-1, 0, 1]:
-                if dx == 0 and dy == 0:
-                    continue
-                nx = x + dx
-                ny = y + dy
-                if 0 <= nx < height and 0 <= ny < width:
-                    neighbors.append((nx, ny))
-        return neighbors
-
-    # Function to perform DFS traversal to find connected components
-    def dfs(x, y, label):
-        """
-        Performs depth-first search traversal to find connected components.
-
-        Args:
-            - x (int): X-coordinate of the starting pixel.
-            - y (int): Y-coordinate of the starting pixel.
-            - label (int): Label of the connected component.
-
-        Returns:
-            - int: Size of the connected component.
-        """
-        stack = [(x, y)]
-        size = 0
-        while stack:
-            cx, cy = stack.pop()
-            if visited[cx][cy]:
-                continue
-            visited[cx][cy] = True
-            labels[cx][cy] = label
-            size += 1
-            for nx, ny in get_neighbors(cx, cy):
-                if image[nx][ny] == 1 and not visited[nx][ny]:
-                    stack.append((nx, ny))
-        return size
-
-    # Initialize data structures
-    visited = [[False] * width for _ in range(height)]
-    labels = [[0] * width for _ in range(height)]
-    label_count = 0
-    component_sizes = {}
-
-    # Perform connected component labeling
-    for i in range(height):
-        for j in range(width):
-            if image[i][j] == 1 and not visited[i][j]:
-                label_count += 1
-                size = dfs(i, j, label_count)
-                component_sizes[label_count] = size
-
-    # Find the largest component
-    largest_component_label = max(component_sizes, key=component_sizes.get)
+    # Find the largest component, the first one wins a tie
+    largest_component_label = max(range(1, len(sizes)),
+                                  key=lambda label: sizes[label])
 
     # Create a set of pixels belonging to the largest component
-    largest_component_pixels = set()
-    for i in range(height):
-        for j in range(width):
-            if labels[i][j] == largest_component_label:
-                largest_component_pixels.add((i, j))
+    rows, cols = np.nonzero(labels == largest_component_label)
+    largest_component_pixels = set(zip(rows.tolist(), cols.tolist()))
 
     return largest_component_pixels
 
@@ -228,6 +249,57 @@ def zero_non_largest_components(image, largest_component_pixels):
     return image
 
 
+# @profile
+def pixels_effect(image_input, shap_numpy):
+    """
+    Measures the SHAP attributions that fall outside the central area of an
+    image.
+
+    Args:
+        - image_input (numpy.ndarray): The input image.
+        - shap_numpy (numpy.ndarray): The SHAP values of the image for each
+                                        target.
+
+    Returns:
+        tuple: A tuple containing two lists with one value per target:
+            - The number of pixels outside the central area that affect the
+                result.
+            - The mean effect of these pixels.
+    """
+
+    image_filtered = full_squeeze(image_input)
+    _, upper = np.percentile(image_filtered, [2.5, 99.9])
+    image_filtered[image_filtered < upper] = 0
+    image_filtered[image_filtered != 0] = 1
+
+    largest_component = connected_components(image_filtered)
+    image_filtered = zero_non_largest_components(image_filtered,
+                                                 largest_component)
+    pixels_sample = []
+    effect_sample = []
+
+    for shap_values in shap_numpy:
+        original = shap_values.copy()
+        shap_filtered = full_squeeze(shap_values).copy()
+        lower, upper = np.percentile(shap_filtered, [0.1, 99.9])
+
+        shap_filtered[shap_filtered >= upper] = 1
+        shap_filtered[shap_filtered <= lower] = 1
+        shap_filtered[shap_filtered != 1] = 0
+
+        mask = np.abs(shap_filtered - image_filtered)
+        final_values = full_squeeze(original)
+        final_values[mask == 0] = 0
+        non_zero_pixels_effect = np.count_nonzero(final_values)
+        sum_values = np.sum(np.abs(final_values))
+        mean_effect = sum_values / non_zero_pixels_effect
+
+        pixels_sample.append(non_zero_pixels_effect)
+        effect_sample.append(mean_effect)
+
+    return pixels_sample, effect_sample
+
+
 # @profile
 def overall_score(data, background_size, model_py, check_samples=-1):
     """
@@ -250,11 +322,7 @@ def overall_score(data, background_size, model_py, check_samples=-1):
     ds = ImageDataset_normalised(data)
     device = torch.device('cpu')
 
-    shap_loader = DataLoader(ds, batch_size=background_size, shuffle=True)
-    background, _ = next(iter(shap_loader))
-    background = background.to(device)
-
-    explainer = shap.DeepExplainer(model_py, background)
+    explainer = deep_explainer(data, background_size, model_py)
 
     if check_samples == -1:
         samples_list = range(ds.__len__())
@@ -280,44 +348,7 @@ def overall_score(data, background_size, model_py, check_samples=-1):
             shap_numpy = np.array(shap_values).transpose(0, 2, 3, 1)
             shap_numpy = np.expand_dims(shap_numpy, axis=0)
 
-        image_filtered = full_squeeze(image_input)
-        # plt.imshow(image_filtered)
-        # plt.show()
-        _, upper = np.percentile(image_filtered, [2.5, 99.9])
-        image_filtered[image_filtered < upper] = 0
-        image_filtered[image_filtered != 0] = 1
-
-        largest_component = connected_components(image_filtered)
-        image_filtered = zero_non_largest_components(image_filtered,
-                                                     largest_component)
-        pixels_sample = []
-        effect_sample = []
-
-        # plt.imshow(image_filtered)
-        # plt.show()
-        for shap_values in shap_numpy:
-            original = shap_values.copy()
-            shap_filtered = full_squeeze(shap_values).copy()
-            # plt.imshow(shap_filtered)
-            # plt.show()
-            lower, upper = np.percentile(shap_filtered, [0.1, 99.9])
-
-            shap_filtered[shap_filtered >= upper] = 1
-            shap_filtered[shap_filtered <= lower] = 1
-            shap_filtered[shap_filtered != 1] = 0
-
-            mask = np.abs(shap_filtered - image_filtered)
-            final_values = full_squeeze(original)
-            final_values[mask == 0] = 0
-            # plt.imshow(final_values)
-            # plt.show()
-            non_zero_pixels_effect = np.count_nonzero(final_values)
-            sum_values = np.sum(np.abs(final_values))
-            mean_effect = sum_values / non_zero_pixels_effect
-
-            pixels_sample.append(non_zero_pixels_effect)
-            effect_sample.append(mean_effect)
-
+        pixels_sample, effect_sample = pixels_effect(image_input, shap_numpy)
         pixels_off.append(pixels_sample)
         effect.append(effect_sample)
 
@@ -403,8 +434,9 @@ def shap_overview(data, batch_background, batch_test, model_py):
                           feature_names=feature_names,
                           show=False)
 
-        plots.append(plt.gcf())
-        plt.close()
+        fig = plt.gcf()
+        plots.append(fig)
+        plt.close(fig)
     return plots
 
 
@@ -422,7 +454,8 @@ def integrated_grad(model, datasample):
 
     input_py = torch.from_numpy(np.expand_dims(datasample, axis=0))
     ig = IntegratedGradients(model)
-    len_targets = len(model(input_py).detach().numpy()[0])
+    with torch.no_grad():
+        len_targets = model(input_py).shape[1]
     grads = []
     for i in range(len_targets):
         attributions = ig.attribute(input_py, target=i)
@@ -443,9 +476,10 @@ def deeplift(model, datasample):
     """
 
     input_py = torch.from_numpy(np.expand_dims(datasample, axis=0))
-    input_py.requires_grad = True
     ig = DeepLift(model.eval())
-    len_targets = len(model(input_py).detach().numpy()[0])
+    with torch.no_grad():
+        len_targets = model(input_py).shape[1]
+    input_py.requires_grad = True
     dl_arrays = []
     for i in range(len_targets):
         attributions = ig.attribute(input_py, target=i).detach().numpy()